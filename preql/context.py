@@ -1,32 +1,32 @@
 import threading
 from contextlib import contextmanager
 
+_MISSING = object()
 
-class Context(threading.local):
-    def __init__(self):
-        self._ctx = [{}]
 
-    def __getattr__(self, name):
-        for scope in reversed(self._ctx):
-            if name in scope:
-                return scope[name]
+class Context(threading.local):
+    """Thread-local, dynamically scoped attributes
 
-        raise AttributeError(name)
+    Attributes are set directly on the (per-thread) instance, and restored on exit,
+    so reading them is a plain attribute lookup. (context.state is read on every step)
+    """
 
     def get(self, name, default=None):
-        try:
-            return getattr(self, name)
-        except AttributeError:
-            return default
+        return getattr(self, name, default)
 
     @contextmanager
     def __call__(self, **attrs):
-        self._ctx.append(attrs)
+        d = self.__dict__
+        prev = {name: d.get(name, _MISSING) for name in attrs}
+        d.update(attrs)
         try:
             yield
         finally:
-            _d = self._ctx.pop()
-            assert attrs is _d
+            for name, value in prev.items():
+                if value is _MISSING:
+                    del d[name]
+                else:
+                    d[name] = value
 
 
 def test_threading():
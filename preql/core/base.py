@@ -1,4 +1,6 @@
 class Object:
+    __slots__ = ()
+
     def repr(self):
         return repr(self)
 
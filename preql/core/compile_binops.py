@@ -2,6 +2,7 @@ import operator
 
 from preql import settings
 
+from . import pql_ast as ast
 from . import pql_objects as objects
 from . import sql
 from .casts import cast
@@ -117,6 +118,18 @@ def _prepare_to_compare(op, a: id_or_relation, b: id_or_relation):
     pass
 
 
+_CMP_OPS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<>': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+}
+
+
 @dp_inst
 def _compare(op, a: T.primitive, b: T.primitive):
     if (
@@ -124,15 +137,7 @@ def _compare(op, a: T.primitive, b: T.primitive):
         and isinstance(a, objects.ValueInstance)
         and isinstance(b, objects.ValueInstance)
     ):
-        f = {
-            '=': operator.eq,
-            '!=': operator.ne,
-            '<>': operator.ne,
-            '>': operator.gt,
-            '<': operator.lt,
-            '>=': operator.ge,
-            '<=': operator.le,
-        }[op]
+        f = _CMP_OPS[op]
         try:
             return pyvalue_inst(f(a.local_value, b.local_value))
         except TypeError as e:
@@ -183,12 +188,15 @@ def contains(op, a, b):
     return objects.inherit_phantom_type(res, [a, b])
 
 
+_STR_CONTAINS_FUNCS = {
+    'in': 'str_contains',
+    '!in': 'str_notcontains',
+}
+
+
 @dp_inst
 def _contains(op, a: T.string, b: T.string):
-    f = {
-        'in': 'str_contains',
-        '!in': 'str_notcontains',
-    }[op]
+    f = _STR_CONTAINS_FUNCS[op]
     return call_builtin_func(f, [a, b])
 
 
@@ -229,18 +237,20 @@ def _compile_arith(arith, a: T.any, b: T.any):
     )
 
 
+_TABLE_OPS = {
+    "+": 'table_concat',
+    "&": 'table_intersect',
+    "|": 'table_union',
+    "-": 'table_subtract',
+}
+
+
 @dp_inst
 def _compile_arith(arith, a: T.table, b: T.table):
     # TODO validate types
-    ops = {
-        "+": 'table_concat',
-        "&": 'table_intersect',
-        "|": 'table_union',
-        "-": 'table_subtract',
-    }
     # TODO compile preql funccall?
     try:
-        op = ops[arith.op]
+        op = _TABLE_OPS[arith.op]
     except KeyError:
         raise Signal.make(
             T.TypeError,
@@ -262,6 +272,17 @@ def _compile_arith(arith, a: T.string, b: T.int):
     return call_builtin_func("repeat", [a, b])
 
 
+_ARITH_OPS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '/~': operator.floordiv,
+    '%': operator.mod,
+    '**': operator.pow,
+}
+
+
 @dp_inst
 def _compile_arith(arith, a: T.number, b: T.number):
     if arith.op in ('/', '**') or a.type <= T.float or b.type <= T.float:
@@ -270,15 +291,7 @@ def _compile_arith(arith, a: T.number, b: T.number):
         res_type = T.int
 
     try:
-        f = {
-            '+': operator.add,
-            '-': operator.sub,
-            '*': operator.mul,
-            '/': operator.truediv,
-            '/~': operator.floordiv,
-            '%': operator.mod,
-            '**': operator.pow,
-        }[arith.op]
+        f = _ARITH_OPS[arith.op]
     except KeyError:
         raise Signal.make(
             T.TypeError,
@@ -297,7 +310,7 @@ def _compile_arith(arith, a: T.number, b: T.number):
         try:
             value = f(a.local_value, b.local_value)
         except ZeroDivisionError as e:
-            raise Signal.make(T.ValueError, arith.args[-1], str(e))
+            raise Signal.make(T.ValueError, arith.right, str(e))
         if arith.op == '**':
             value = float(value)
         return pyvalue_inst(value, res_type)
@@ -327,3 +340,66 @@ def _compile_arith(arith, a: T.string, b: T.string):
 
     code = sql.arith(T.string, arith.op, [a.code, b.code])
     return make_instance(code, T.string, [a, b])
+
+
+## Constant folding (at parse time)
+#
+# Follows the same rules as the local folding in compare() and compile_arith(),
+# but only for the simplest types, where the outcome can't depend on the context.
+# Returns None when the expression can't be folded, or when folding would raise an error,
+# so it can be reported (or handled by SQL) when the expression is evaluated.
+
+_FOLDABLE_TYPES = (T.int, T.float, T.string, T.bool)
+_NUMBER_TYPES = (T.int, T.float)
+
+
+def _is_foldable(*args):
+    return settings.optimize and all(
+        isinstance(a, ast.Const) and a.type in _FOLDABLE_TYPES for a in args
+    )
+
+
+def fold_compare(op, a, b):
+    if op not in _CMP_OPS or not _is_foldable(a, b):
+        return None
+    if a.type != b.type and not (a.type in _NUMBER_TYPES and b.type in _NUMBER_TYPES):
+        return None
+
+    return ast.Const(T.bool, _CMP_OPS[op](a.value, b.value))
+
+
+def fold_arith(op, a, b):
+    if op not in _ARITH_OPS or not _is_foldable(a, b):
+        return None
+    if not (a.type in _NUMBER_TYPES and b.type in _NUMBER_TYPES):
+        return None
+
+    if op in ('/', '**') or T.float in (a.type, b.type):
+        res_type = T.float
+    else:
+        res_type = T.int
+
+    try:
+        value = _ARITH_OPS[op](a.value, b.value)
+        if op == '**':
+            value = float(value)
+    except (ArithmeticError, TypeError):  # TypeError for complex results
+        return None
+
+    return ast.Const(res_type, value)
+
+
+def fold_neg(expr):
+    if _is_foldable(expr) and expr.type in _NUMBER_TYPES:
+        return ast.Const(expr.type, -expr.value)
+
+
+def fold_not(expr):
+    if _is_foldable(expr) and expr.type == T.bool:
+        return ast.Const(T.bool, not expr.value)
+
+
+def fold_logical(op, a, b):
+    if _is_foldable(a, b) and a.type == b.type == T.bool:
+        value = (a.value or b.value) if op == 'or' else (a.value and b.value)
+        return ast.Const(T.bool, value)
@@ -1,17 +1,17 @@
+from functools import lru_cache
+from itertools import chain
+from operator import attrgetter
+
+from preql import settings
 from preql.context import context
-from preql.utils import SafeDict, find_duplicate, listgen, method, re_split, safezip
+from preql.utils import SafeDict, find_duplicate, listgen, method, re_split
 
 from . import pql_ast as ast
 from . import pql_objects as objects
 from . import sql
 from .casts import cast
 from .compile_binops import compare, compile_arith, contains
-from .exceptions import (
-    InsufficientAccessLevel,
-    ReturnSignal,
-    Signal,
-    pql_AttributeError,
-)
+from .exceptions import InsufficientAccessLevel, Signal, pql_AttributeError
 from .interp_common import (
     assert_type,
     cast_to_python_int,
@@ -27,6 +27,8 @@ from .state import (
     get_access_level,
     get_db,
     get_var,
+    pop_scope,
+    push_scope,
     require_access,
     unique_name,
     use_scope,
@@ -38,19 +40,13 @@ class AutocompleteSuggestions(Exception):
     pass
 
 
-@dsp
-def cast_to_instance(x: list):
-    return [cast_to_instance(i) for i in x]
-
-
-@dsp
 def cast_to_instance(x):
-    try:
-        x = x.simplify()  # just compile Name?
-        inst = x.compile_to_inst()
-        # inst = evaluate( x)
-    except ReturnSignal:
-        raise Signal.make(T.CompileError, None, f"Bad compilation of {x}")
+    if isinstance(x, list):
+        return [cast_to_instance(i) for i in x]
+
+    x = x.simplify()  # just compile Name?
+    inst = x.compile_to_inst()
+    # inst = evaluate( x)
 
     if isinstance(inst, ast.ParameterizedSqlCode):
         raise InsufficientAccessLevel(inst)
@@ -102,10 +98,24 @@ def _exclude_items(d, req_exclude, opt_exclude):
             yield k, v
 
 
-@listgen
 def _expand_ellipsis(obj, fields):
-    direct_names = {f.value.name for f in fields if isinstance(f.value, ast.Name)}
+    direct_names = set()
+    has_ellipsis = False
+    for f in fields:
+        if isinstance(f.value, ast.Name):
+            direct_names.add(f.value.name)
+        elif isinstance(f.value, ast.Ellipsis):
+            has_ellipsis = True
+
+    if not has_ellipsis:
+        # Common case, nothing to expand
+        return list(fields)
 
+    return _expand_ellipsis_fields(obj, fields, direct_names)
+
+
+@listgen
+def _expand_ellipsis_fields(obj, fields, direct_names):
     for f in fields:
         assert isinstance(f, ast.NamedField)
 
@@ -235,6 +245,36 @@ def compile_to_inst(i: ast.If):
     return objects.inherit_phantom_type(inst, [cond, then, else_])
 
 
+def _projection_type(field_types):
+    "Returns the table type of a projection, and the names of its flattened columns"
+    reserved_names = {name for (user_defined, name), _ in field_types if user_defined}
+    elems = {}
+    flat_names = []
+    for (user_defined, name), type_ in field_types:
+        # Unvectorize for placing in the table type
+        type_ = kernel_type(type_)
+
+        # Find name without collision
+        if not user_defined:
+            name_ = name
+            i = 1
+            while name in elems or name in reserved_names:
+                name = name_ + str(i)
+                i += 1
+
+        assert name not in elems
+        elems[name] = type_
+        flat_names += [n for n, _t in flatten_type(type_, [name])]
+
+    # TODO inherit primary key? indexes?
+    # codename = state.unique_name('proj')
+    t = T.table(elems, temporary=False)  # XXX abstract=True
+    return t, tuple(flat_names)
+
+
+_name_key = attrgetter('name')
+
+
 @method
 def compile_to_inst(proj: ast.Projection):
     table = cast_to_instance(proj.table)
@@ -251,21 +291,25 @@ def compile_to_inst(proj: ast.Projection):
     fields = _expand_ellipsis(table, proj.fields)
 
     # Test duplicates in field names. If an automatic name is used, collision should be impossible
-    dup = find_duplicate(
-        [f for f in list(proj.fields) + list(proj.agg_fields) if f.name],
-        key=lambda f: f.name,
-    )
-    if dup:
-        raise Signal.make(
-            T.TypeError, dup, f"Field '{dup.name}' was already used in this projection"
-        )
+    named = [f for f in chain(proj.fields, proj.agg_fields) if f.name]
+    if len(named) >= 2:
+        dup = find_duplicate(named, key=_name_key)
+        if dup:
+            raise Signal.make(
+                T.TypeError,
+                dup,
+                f"Field '{dup.name}' was already used in this projection",
+            )
 
     attrs = (
         table.all_attrs()
     )  # TODO separate here between columns and methods? (not it's done in _process_fields)
 
-    with use_scope({n: projected(c) for n, c in attrs.items()}):
+    token = push_scope({n: projected(c) for n, c in attrs.items()})
+    try:
         fields = _process_fields(fields)
+    finally:
+        pop_scope(token)
 
     for name, f in fields:
         if not f.type <= T.union[T.primitive, T.struct, T.json, T.nulltype, T.unknown]:
@@ -280,8 +324,11 @@ def compile_to_inst(proj: ast.Projection):
 
     agg_fields = []
     if proj.agg_fields:
-        with use_scope({n: objects.aggregate(c) for n, c in attrs.items()}):
+        token = push_scope({n: objects.aggregate(c) for n, c in attrs.items()})
+        try:
             agg_fields = _process_fields(proj.agg_fields)
+        finally:
+            pop_scope(token)
 
     all_fields = fields + agg_fields
     assert all(isinstance(inst, AbsInstance) for name_, inst in all_fields)
@@ -289,35 +336,14 @@ def compile_to_inst(proj: ast.Projection):
     #
     # Make new type (and resolve names)
     #
-    field_types = [(name, inst.type) for name, inst in all_fields]
-    reserved_names = {name[1] for name, _ in all_fields if name[0]}
-    elems = {}
-    for (user_defined, name), type_ in field_types:
-        # Unvectorize for placing in the table type
-        type_ = kernel_type(type_)
-
-        # Find name without collision
-        if not user_defined:
-            name_ = name
-            i = 1
-            while name in elems or name in reserved_names:
-                name = name_ + str(i)
-                i += 1
-
-        assert name not in elems
-        elems[name] = type_
-
-    # TODO inherit primary key? indexes?
-    # codename = state.unique_name('proj')
-    new_table_type = T.table(elems, temporary=False)  # XXX abstract=True
+    new_table_type, flat_names = _projection_type(
+        [(name, inst.type) for name, inst in all_fields]
+    )
 
     # Make code
     flat_codes = [code for _, inst in all_fields for code in inst.flatten_code()]
-
-    sql_fields = [
-        sql.ColumnAlias.make(code, nn)
-        for code, (nn, _nt) in safezip(flat_codes, flatten_type(new_table_type))
-    ]
+    assert len(flat_codes) == len(flat_names)
+    sql_fields = list(map(sql.ColumnAlias.make, flat_codes, flat_names))
 
     if not sql_fields:
         raise Signal.make(
@@ -353,8 +379,11 @@ def compile_to_inst(order: ast.Order):
     table = cast_to_instance(order.table)
     assert_type(table.type, T.table, order, "'order'")
 
-    with use_scope(table.all_attrs()):
+    token = push_scope(table.all_attrs())
+    try:
         fields = cast_to_instance(order.fields)
+    finally:
+        pop_scope(token)
 
     for f in fields:
         if not f.type <= T.primitive:
@@ -411,18 +440,22 @@ def compile_to_inst(o: ast.Not):
     return objects.make_instance(code, T.bool, [expr])
 
 
+_CMP_OP_ALIASES = {
+    '==': '=',
+    '<>': '!=',
+}
+
+
 @method
 def compile_to_inst(cmp: ast.Compare):
-    insts = evaluate(cmp.args)
+    a = evaluate(cmp.left)
+    b = evaluate(cmp.right)
 
     if cmp.op == 'in' or cmp.op == '!in':
-        return contains(cmp.op, insts[0], insts[1])
+        return contains(cmp.op, a, b)
 
-    op = {
-        '==': '=',
-        '<>': '!=',
-    }.get(cmp.op, cmp.op)
-    return compare(op, insts[0], insts[1])
+    op = _CMP_OP_ALIASES.get(cmp.op, cmp.op)
+    return compare(op, a, b)
 
 
 @method
@@ -430,13 +463,18 @@ def compile_to_inst(neg: ast.Neg):
     expr = cast_to_instance(neg.expr)
     assert_type(expr.type, T.number, neg, "Negation")
 
+    if settings.optimize and isinstance(expr, objects.ValueInstance):
+        # Local folding, so constant expressions like -(2*3) + 1 fold all the way
+        return pyvalue_inst(-expr.local_value, expr.type)
+
     return make_instance(sql.Neg(expr.code), expr.type, [expr])
 
 
 @method
 def compile_to_inst(arith: ast.BinOp):
-    args = cast_to_instance(arith.args)
-    return compile_arith(arith, *args)
+    a = cast_to_instance(arith.left)
+    b = cast_to_instance(arith.right)
+    return compile_arith(arith, a, b)
 
 
 @method
@@ -444,12 +482,30 @@ def compile_to_inst(x: ast.Ellipsis):
     raise Signal.make(T.SyntaxError, x, "Ellipsis not allowed here")
 
 
+@lru_cache(maxsize=4096)
+def _const_inst(value, pytype, type_id, type_, target, optimize):
+    """Returns the instance of a constant. Memoized, since literals are compiled repeatedly
+
+    The type is keyed by identity (type_id), because Type equality ignores options and nullability.
+    (type_ itself is in the key to keep it alive, so its id can't be reused)
+    target is part of the key because strings are quoted differently per database.
+
+    The returned instance is shared between callers, and must not be mutated.
+    """
+    return pyvalue_inst(value, type_)
+
+
 @method
 def compile_to_inst(c: ast.Const):
     if c.type == T.nulltype:
         assert c.value is None
         return objects.null
-    return pyvalue_inst(c.value, c.type)
+    value = c.value
+    if isinstance(value, float):
+        return pyvalue_inst(value, c.type)  # Not cached, because -0.0 == 0.0
+    return _const_inst(
+        value, type(value), id(c.type), c.type, get_db().target, settings.optimize
+    )
 
 
 @method
@@ -477,16 +533,23 @@ def compile_to_inst(lst: ast.List_):
         # XXX a little awkward
         return objects.EmptyList
 
-    elems = evaluate(lst.elems)
-
-    types = {e.type for e in elems}
-
-    if len(types) > 1:
-        raise Signal.make(
-            T.TypeError, lst, f"List members must be of the same type. Got {types}"
-        )
-
-    (elem_type,) = types
+    if all(type(e) is ast.Const for e in lst.elems):
+        # Literal list. Constants always compile to values, so skip the evaluation machinery
+        elems = [e.compile_to_inst() for e in lst.elems]
+    else:
+        elems = evaluate(lst.elems)
+
+    # Same as comparing the members of {e.type for e in elems}, whose hash includes nullability
+    elem_type = elems[0].type
+    elem_hash = hash(elem_type)
+    for e in elems:
+        if e.type is not elem_type and (
+            hash(e.type) != elem_hash or e.type != elem_type
+        ):
+            types = {e.type for e in elems}
+            raise Signal.make(
+                T.TypeError, lst, f"List members must be of the same type. Got {types}"
+            )
 
     if elem_type <= T.struct:
         rows = [sql.ValuesTuple(obj.type, obj.flatten_code()) for obj in elems]
@@ -494,7 +557,7 @@ def compile_to_inst(lst: ast.List_):
         name = unique_name("table_")
         table_code, subq = sql.create_table(list_type, name, rows)
     else:
-        if elem_type <= (T.projected | T.aggregated):
+        if elem_type <= objects.phantom_types:
             raise Signal.make(
                 T.TypeError,
                 lst,
@@ -682,14 +745,17 @@ def compile_to_inst(sel: ast.Selection):
             type=T.string
         )  # XXX why get rid of projected here? because it's a table operation node?
         slice = ast.Slice(
-            table, ast.Range(index, ast.BinOp('+', [index, ast.Const(T.int, 1)]))
+            table, ast.Range(index, ast.BinOp('+', index, ast.Const(T.int, 1)))
         ).set_text_ref(sel.text_ref)
         return slice.compile_to_inst()
 
     assert_type(table.type, T.table, sel, "Selection")
 
-    with use_scope({n: projected(c) for n, c in table.all_attrs().items()}):
+    token = push_scope({n: projected(c) for n, c in table.all_attrs().items()})
+    try:
         conds = cast_to_instance(sel.conds)
+    finally:
+        pop_scope(token)
 
     if any(t <= T.unknown for t in table.type.elem_types):
         code = sql.unknown
@@ -776,6 +842,9 @@ def compile_to_inst(marker: ast.Marker):
     raise AutocompleteSuggestions(all_vars)
 
 
+_range_type = T.list[T.int]
+
+
 @method
 def compile_to_inst(range: ast.Range):
     target = get_db().target
@@ -796,7 +865,7 @@ def compile_to_inst(range: ast.Range):
             T.NotImplementedError, range, f"{target} doesn't support infinite series!"
         )
 
-    type_ = T.list[T.int]
+    type_ = _range_type
 
     if target == sql.bigquery:
         # Ensure SELECT *, since UNNEST at the root level is a syntax error
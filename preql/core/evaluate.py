@@ -11,7 +11,7 @@ from . import pql_ast as ast
 from . import pql_objects as objects
 from . import sql
 from .compiler import cast_to_instance
-from .exceptions import InsufficientAccessLevel, ReturnSignal, Signal
+from .exceptions import InsufficientAccessLevel, Signal
 from .interp_common import (
     assert_type,
     call_builtin_func,
@@ -19,6 +19,7 @@ from .interp_common import (
     cast_to_python_int,
     cast_to_python_string,
     dsp,
+    evaluate,
     exclude_fields,
     is_global_scope,
     pyvalue_inst,
@@ -32,6 +33,8 @@ from .state import (
     get_db,
     get_var,
     has_var,
+    pop_scope,
+    push_scope,
     reduce_access,
     set_var,
     unique_name,
@@ -246,7 +249,7 @@ def _execute(table_def: ast.TableDefFromExpr):
 def _execute(var_def: ast.SetValue):
     res = evaluate(var_def.value)
 
-    if res.type <= T.primitive and not res.type <= (T.union[T.aggregated, T.projected]):
+    if res.type <= T.primitive and not res.type <= objects.phantom_types:
         res = objects.pyvalue_inst(res.localize(), res.type)
 
     _set_value(var_def.name, res)
@@ -399,10 +402,27 @@ def _execute(p: ast.Assert):
         raise Signal.make(T.AssertError, p.cond, f"Assertion failed: {s}")
 
 
+@dataclass
+class ReturnValue:
+    """Result of executing a 'return' statement.
+
+    Statements that contain other statements pass it up as-is, until it reaches the function call.
+    (Cheaper than unwinding with an exception)
+    """
+
+    value: Object
+
+
 @method
 def _execute(cb: ast.CodeBlock):
     for stmt in cb.statements:
-        execute(stmt)
+        # Inlined execute(), since the result only matters if it's a ReturnValue
+        if isinstance(stmt, ast.Statement):
+            res = stmt._execute()
+        else:
+            res = evaluate(stmt)
+        if isinstance(res, ReturnValue):
+            return res
     return objects.null
 
 
@@ -411,29 +431,36 @@ def _execute(i: ast.If):
     cond = cast_to_python(i.cond)
 
     if cond:
-        execute(i.then)
+        return execute(i.then)
     elif i.else_:
-        execute(i.else_)
+        return execute(i.else_)
 
 
 @method
 def _execute(w: ast.While):
     while cast_to_python(w.cond):
-        execute(w.do)
+        res = execute(w.do)
+        if isinstance(res, ReturnValue):
+            return res
 
 
 @method
 def _execute(f: ast.For):
     expr = cast_to_python(f.iterable)
     for i in expr:
-        with use_scope({f.var: objects.from_python(i)}):
-            execute(f.do)
+        token = push_scope({f.var: objects.from_python(i)})
+        try:
+            res = execute(f.do)
+        finally:
+            pop_scope(token)
+        if isinstance(res, ReturnValue):
+            return res
 
 
 @method
 def _execute(t: ast.Try):
     try:
-        execute(t.try_)
+        return execute(t.try_)
     except Signal as e:
         catch_type = evaluate(t.catch_expr).localize()
         if not isinstance(catch_type, Type):
@@ -445,7 +472,7 @@ def _execute(t: ast.Try):
         if e.type <= catch_type:
             scope = {t.catch_name: e} if t.catch_name else {}
             with use_scope(scope):
-                execute(t.catch_block)
+                return execute(t.catch_block)
         else:
             raise
 
@@ -491,8 +518,7 @@ def _execute(r: ast.Import):
 
 @method
 def _execute(r: ast.Return):
-    value = evaluate(r.value)
-    raise ReturnSignal(value)
+    return ReturnValue(evaluate(r.value))
 
 
 @method
@@ -520,10 +546,7 @@ def simplify(cb: ast.CodeBlock):
     #     s ,= cb.statements
     #     return simplify(s)
     try:
-        return cb._execute()
-    except ReturnSignal as r:
-        # XXX is this correct?
-        return r.value
+        res = cb._execute()
     except Signal as e:
         # Failed to run it, so try to cast as instance
         # XXX order should be other way around!
@@ -533,6 +556,11 @@ def simplify(cb: ast.CodeBlock):
     except InsufficientAccessLevel:
         return cb
 
+    if isinstance(res, ReturnValue):
+        # XXX is this correct?
+        return res.value
+    return res
+
 
 @method
 def simplify(n: ast.Name):
@@ -730,10 +758,13 @@ def eval_func_call(func, args):
             # Don't cache
             pass
 
-    with use_scope({**ordered_args, '__unwind__': []}):
+    token = push_scope({**ordered_args, '__unwind__': []})
+    try:
         res = _call_expr(expr)
         # for to_unwind in get_var('__unwind__'):
         #     to_unwind()
+    finally:
+        pop_scope(token)
 
     if isinstance(res, ast.ResolveParameters):  # XXX A bit of a hack
         raise exc.InsufficientAccessLevel()
@@ -742,10 +773,8 @@ def eval_func_call(func, args):
 
 
 def _call_expr(expr):
-    try:
-        return evaluate(expr)
-    except ReturnSignal as r:
-        return r.value
+    # 'return' is handled by simplify(ast.CodeBlock)
+    return evaluate(expr)
 
 
 # TODO fix these once we have proper types
@@ -809,6 +838,17 @@ def apply_database_rw(o: ast.One):
     return objects.RowInstance(rowtype, d)
 
 
+def _localize_ids(table, ast_node, error_msg):
+    """Returns the ids of the rows in table, without fetching the other columns"""
+    if 'id' not in table.type.elems:
+        if table.localize():
+            raise Signal.make(T.TypeError, ast_node, error_msg)
+        return []
+
+    ids = ast.Projection(table, [ast.NamedField('id', ast.Name('id'))])
+    return [row['id'] for row in evaluate(ids).localize()]
+
+
 @method
 def apply_database_rw(d: ast.Delete):
     catch_access(AccessLevels.WRITE_DB)
@@ -825,15 +865,9 @@ def apply_database_rw(d: ast.Delete):
             T.ValueError, d.table, "Cannot delete. Table is not persistent"
         )
 
-    rows = list(table.localize())
-    if rows:
-        if 'id' not in rows[0]:
-            raise Signal.make(T.TypeError, d, "Delete error: Table does not contain id")
-
-        ids = [row['id'] for row in rows]
-
-        for code in sql.deletes_by_ids(table, ids):
-            db_query(code, table.subqueries)
+    ids = _localize_ids(table, d, "Delete error: Table does not contain id")
+    for code in sql.deletes_by_ids(table, ids):
+        db_query(code, table.subqueries)
 
     return evaluate(d.table)
 
@@ -865,17 +899,13 @@ def apply_database_rw(u: ast.Update):
     with use_scope(update_scope):
         proj = {f.name: evaluate(f.value) for f in u.fields}
 
-    rows = list(table.localize())
-    if rows:
-        if 'id' not in rows[0]:
-            raise Signal.make(T.TypeError, u, "Update error: Table does not contain id")
-        if not set(proj) < set(rows[0]):
+    ids = _localize_ids(table, u, "Update error: Table does not contain id")
+    if ids:
+        if not set(proj) < set(table.type.elems):
             raise Signal.make(
                 T.TypeError, u, "Update error: Not all keys exist in table"
             )
 
-        ids = [row['id'] for row in rows]
-
         for code in sql.updates_by_ids(table, proj, ids):
             db_query(code, table.subqueries)
 
@@ -918,13 +948,16 @@ def apply_database_rw(new: ast.NewRows):
 
     cons = TableConstructor.make(obj)
 
-    # TODO very inefficient, vectorize this
-    ids = []
-    for row in rows:
-        matched = cons.match_params([objects.from_python(v) for v in row.values()])
-        ids += [
-            _new_row(new, obj, matched).primary_key()
-        ]  # XXX return everything, not just pk?
+    matched_rows = [
+        cons.match_params([objects.from_python(v) for v in row.values()])
+        for row in rows
+    ]
+    if get_db().target == sql.sqlite:
+        new_rows = _new_rows(new, obj, matched_rows)
+    else:
+        new_rows = [_new_row(new, obj, matched) for matched in matched_rows]
+
+    ids = [r.primary_key() for r in new_rows]  # XXX return everything, not just pk?
 
     # XXX find a nicer way - requires a better typesystem, where id(t) < int
     return ast.List_(T.list[T.int], ids).set_text_ref(new.text_ref)
@@ -967,7 +1000,8 @@ def freeze(i: objects.RowInstance):
     return i.replace(attrs={k: freeze(v) for k, v in i.attrs.items()})
 
 
-def _new_row(new_ast, table, matched):
+def _prepare_new_row(new_ast, table, matched):
+    """Returns (table_name, keys, values, matched) for inserting a new row"""
     matched = [(k, freeze(evaluate(v))) for k, v in matched]
     destructured_pairs = _destructure_param_match(new_ast, matched)
 
@@ -982,11 +1016,6 @@ def _new_row(new_ast, table, matched):
             f"'new' expects a persistent table. Instead got a table expression.",
         )
 
-    if get_db().target == sql.bigquery:
-        rowid = db_query(sql.FuncCall(T.string, 'GENERATE_UUID', []))
-        keys += ['id']
-        values += [sql.make_value(rowid)]
-
     try:
         table_name = table.options['name']
     except KeyError:
@@ -994,15 +1023,94 @@ def _new_row(new_ast, table, matched):
             T.ValueError, new_ast, "Cannot add a new row to an unnamed table"
         )
 
+    return table_name, keys, values, matched
+
+
+def _make_new_row(row_type, rowid, matched):
+    attrs = {p.name: v for p, v in matched}
+    # An explicit id takes the place of the generated one
+    id_ = attrs.pop('id', None)
+    if id_ is None:
+        id_ = objects.pyvalue_inst(rowid)
+    d = SafeDict({'id': id_})
+    d.update(attrs)
+    return objects.RowInstance(row_type, d)
+
+
+def _new_row(new_ast, table, matched):
+    return _insert_new_row(table, *_prepare_new_row(new_ast, table, matched))
+
+
+def _insert_new_row(table, table_name, keys, values, matched):
+    if get_db().target == sql.bigquery:
+        rowid = db_query(sql.FuncCall(T.string, 'GENERATE_UUID', []))
+        keys += ['id']
+        values += [sql.make_value(rowid)]
+
     q = sql.InsertConsts(table_name, keys, [values])
     db_query(q)
 
     if get_db().target != sql.bigquery:
         rowid = db_query(sql.LastRowId())
 
-    d = SafeDict({'id': objects.pyvalue_inst(rowid)})
-    d.update({p.name: v for p, v in matched})
-    return objects.RowInstance(T.row[table], d)
+    return _make_new_row(T.row[table], rowid, matched)
+
+
+_NEW_ROWS_BATCH_SIZE = 500
+_SQLITE_MAX_ROWID = 2**63 - 1
+
+
+def _new_rows(new_ast, table, matched_rows):
+    """Insert many rows, using a single INSERT for each batch of rows
+
+    Only for Sqlite. Relies on Sqlite giving each new row the largest rowid in the table + 1,
+    so the rows of one INSERT get consecutive rowids, and the last rowid is enough to know all of them.
+    Once the largest rowid reaches its maximum, Sqlite picks random rowids instead,
+    so batches that don't have room below the maximum are inserted row by row.
+
+    Like without batching, a failure doesn't undo the rows before the failing one.
+    Each batch is prepared just before it's inserted, and the rows that were prepared
+    before a failed preparation are inserted before the error is raised.
+    A failed INSERT inserts none of its rows, so the batch is then retried row by row.
+    """
+    new_rows = []
+    for i in range(0, len(matched_rows), _NEW_ROWS_BATCH_SIZE):
+        batch = []
+        try:
+            for matched in matched_rows[i : i + _NEW_ROWS_BATCH_SIZE]:
+                batch.append(_prepare_new_row(new_ast, table, matched))
+        except Signal:
+            _insert_new_rows_batch(table, batch)
+            raise
+        new_rows += _insert_new_rows_batch(table, batch)
+    return new_rows
+
+
+def _insert_new_rows_batch(table, rows):
+    if not rows:
+        return []
+
+    table_name, keys, _values, _matched = rows[0]
+    if not keys or 'id' in keys or any(r[1] != keys for r in rows):
+        # Can't batch DEFAULT VALUES, and explicit ids might not be consecutive
+        return [_insert_new_row(table, *r) for r in rows]
+
+    max_rowid = sql.RawSql(
+        T.int, f'SELECT coalesce(max(rowid), 0) FROM {sql.quote_id(table_name)}'
+    )
+    if db_query(max_rowid) > _SQLITE_MAX_ROWID - len(rows):
+        return [_insert_new_row(table, *r) for r in rows]
+
+    try:
+        db_query(sql.InsertConsts(table_name, keys, [r[2] for r in rows]))
+    except Signal as e:
+        if not e.type <= T.DbQueryError:
+            raise
+        return [_insert_new_row(table, *r) for r in rows]
+
+    first_rowid = db_query(sql.LastRowId()) - len(rows) + 1
+    row_type = T.row[table]
+    return [_make_new_row(row_type, first_rowid + j, r[3]) for j, r in enumerate(rows)]
 
 
 @method
@@ -1084,47 +1192,6 @@ def add_as_subquery(inst: objects.Instance):
     )
 
 
-@dsp
-def evaluate(obj: list):
-    return [evaluate(item) for item in obj]
-
-
-@dsp
-def evaluate(obj_):
-    access_level = get_access_level()
-
-    # - Generic, non-db related operations
-    obj = obj_.simplify()
-    assert obj, obj_
-
-    if access_level < AccessLevels.COMPILE:
-        return obj
-
-    # - Compile to instances with db-specific code (sql)
-    # . Compilation may fail (e.g. due to lack of DB access)
-    # . Resulting code generic within the same database, and can be cached
-    # obj = compile_to_inst(state.reduce_access(state.AccessLevels.COMPILE), obj)
-    obj = obj.compile_to_inst()
-
-    if access_level < AccessLevels.EVALUATE:
-        return obj
-
-    # - Resolve parameters to "instantiate" the cached code
-    # TODO necessary?
-    if isinstance(obj, ast.Parameter):
-        obj = get_var(obj.name)
-
-    if access_level < AccessLevels.READ_DB:
-        return obj
-
-    # - Apply operations that read or write the database (delete, insert, update, one, etc.)
-    obj = obj.apply_database_rw()
-
-    assert not isinstance(obj, (ast.ResolveParameters, ast.ParameterizedSqlCode)), obj
-
-    return obj
-
-
 #
 #    localize()
 # -------------
@@ -1256,7 +1323,7 @@ def cast_to_python(obj: ast.Ast):
 @dsp
 def cast_to_python(obj: objects.AbsInstance):
     # if state.access_level <= state.AccessLevels.QUERY:
-    if obj.type <= T.projected | T.aggregated:
+    if obj.type <= objects.phantom_types:
         raise exc.InsufficientAccessLevel(get_access_level())
         # raise Signal.make(T.CastError, None, f"Internal error. Cannot cast projected obj: {obj}")
     res = obj.localize()
@@ -7,22 +7,58 @@ from . import pql_ast as ast
 from . import pql_objects as objects
 from .exceptions import Signal
 from .pql_types import T, Type
+from .state import AccessLevels, get_access_level, get_var
 
 logger = getLogger('interp')
 
 # Define common dispatch functions
 
 
-@dsp
-def evaluate(obj: type(NotImplemented)) -> object:
-    raise NotImplementedError()
-
-
 @dsp
 def cast_to_python(obj: type(NotImplemented)) -> object:
     raise NotImplementedError(obj)
 
 
+def evaluate(obj_):
+    # Called for every node, so it avoids dispatch. Each step is a method,
+    # installed per class by compiler.py and evaluate.py
+    if isinstance(obj_, list):
+        return [evaluate(item) for item in obj_]
+
+    access_level = get_access_level()
+
+    # - Generic, non-db related operations
+    obj = obj_.simplify()
+    assert obj, obj_
+
+    if access_level < AccessLevels.COMPILE:
+        return obj
+
+    # - Compile to instances with db-specific code (sql)
+    # . Compilation may fail (e.g. due to lack of DB access)
+    # . Resulting code generic within the same database, and can be cached
+    # obj = compile_to_inst(state.reduce_access(state.AccessLevels.COMPILE), obj)
+    obj = obj.compile_to_inst()
+
+    if access_level < AccessLevels.EVALUATE:
+        return obj
+
+    # - Resolve parameters to "instantiate" the cached code
+    # TODO necessary?
+    if isinstance(obj, ast.Parameter):
+        obj = get_var(obj.name)
+
+    if access_level < AccessLevels.READ_DB:
+        return obj
+
+    # - Apply operations that read or write the database (delete, insert, update, one, etc.)
+    obj = obj.apply_database_rw()
+
+    assert not isinstance(obj, (ast.ResolveParameters, ast.ParameterizedSqlCode)), obj
+
+    return obj
+
+
 def assert_type(
     t, type_, ast_node, op, msg="%s expected an object of type %s, instead got '%s'"
 ):
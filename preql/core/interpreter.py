@@ -8,23 +8,31 @@ from preql.utils import classify
 
 from . import pql_ast as ast
 from . import pql_objects as objects
-from .evaluate import cast_to_python, eval_func_call, evaluate, execute, import_module
-from .exceptions import ReturnSignal, Signal, pql_SyntaxError
+from .evaluate import (
+    ReturnValue,
+    cast_to_python,
+    eval_func_call,
+    evaluate,
+    execute,
+    find_module,
+    import_module,
+)
+from .exceptions import Signal, pql_SyntaxError
 from .interp_common import call_builtin_func, pyvalue_inst
 from .parser import parse_stmts
-from .pql_functions import import_pandas, internal_funcs, joins
+from .pql_functions import internal_funcs, joins
 from .pql_types import Object, T
 from .state import ThreadState
 
 
 def initial_namespace():
     # TODO localinstance / metainstance
-    ns = {k: v for k, v in T.items()}
+    ns = dict(T)
     ns.update(internal_funcs)
     ns.update(joins)
     # TODO all exceptions
     name = '__builtins__'
-    module = objects.Module(name, dict(ns))
+    module = objects.Module(name, ns)  # ns is a fresh dict, so no need to copy it
     return [{name: module}]
 
 
@@ -49,23 +57,38 @@ class LocalCopy(threading.local):
 
 
 class Interpreter:
+    # Namespace of the core module, keyed by (db target, mtime of the core module)
+    # The core module depends on the db type, but otherwise only defines immutable objects,
+    # so they can be shared between interpreters.
+    _core_ns_cache = {}
+
     def __init__(self, sqlengine, display, use_core=True):
         self.state = ThreadState.from_components(
             self, sqlengine, display, initial_namespace()
         )
         if use_core:
-            mns = import_module(
-                self.state, ast.Import('__builtins__', use_core=False)
-            ).namespace
             bns = self.state.get_var('__builtins__').namespace
             # safe-update
-            for k, v in mns.items():
-                if not k.startswith('__'):
-                    assert k not in bns
-                    bns[k] = v
+            for k, v in self._core_namespace().items():
+                assert k not in bns
+                bns[k] = v
 
         self._local_copies = LocalCopy(state=self.state)
 
+    def _core_namespace(self):
+        key = self.state.db.target, find_module('__builtins__').stat().st_mtime_ns
+        try:
+            return self._core_ns_cache[key]
+        except KeyError:
+            pass
+
+        mns = import_module(
+            self.state, ast.Import('__builtins__', use_core=False)
+        ).namespace
+        ns = {k: v for k, v in mns.items() if not k.startswith('__')}
+        self._core_ns_cache[key] = ns
+        return ns
+
     def setup_context(self):
         return context(state=self._local_copies.state)
 
@@ -85,9 +108,8 @@ class Interpreter:
         # with self.state.ns.use_parameters(args or {}):
         with context(parameters=args or {}):  # Set parameters for Namespace.get_var()
             for stmt in stmts:
-                try:
-                    last = execute(stmt)
-                except ReturnSignal:
+                last = execute(stmt)
+                if isinstance(last, ReturnValue):
                     raise Signal.make(T.CodeError, stmt, "'return' outside of function")
 
         return last
@@ -144,6 +166,8 @@ class Interpreter:
 
     @entrypoint
     def import_pandas(self, dfs):
+        from .pql_functions import import_pandas
+
         return list(import_pandas(dfs))
 
     @entrypoint
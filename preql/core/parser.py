@@ -1,12 +1,15 @@
 from ast import literal_eval
+from functools import lru_cache
 from pathlib import Path
 
 from lark import Lark, Transformer, UnexpectedInput, UnexpectedToken, v_args
 
+from preql import settings
 from preql.utils import TextPos, TextRange, TextReference
 
 from . import pql_ast as ast
 from . import pql_objects as objects
+from .compile_binops import fold_arith, fold_compare, fold_logical, fold_neg, fold_not
 from .compiler import guess_field_name
 from .exceptions import pql_SyntaxError
 from .pql_types import Id, T
@@ -110,6 +113,8 @@ def _args_wrapper_list(f, _data, children, meta):
 with_meta = v_args(wrapper=_args_wrapper_meta)
 no_inline = v_args(wrapper=_args_wrapper_list)
 
+_list_type = T.list[T.any]
+
 
 def token_value(self, t):
     return Str(str(t))
@@ -166,7 +171,7 @@ class TreeToAst(Transformer):
 
     @no_inline
     def pql_list(self, items):
-        return ast.List_(T.list[T.any], items)
+        return ast.List_(_list_type, items)
 
     @no_inline
     def as_list(self, args):
@@ -185,24 +190,39 @@ class TreeToAst(Transformer):
     comp_op = token_value
 
     def compare(self, a, op, b):
-        return ast.Compare(op, [a, b])
+        return fold_compare(op, a, b) or ast.Compare(op, a, b)
 
     def _arith_expr(self, a, op, b):
-        return ast.BinOp(op, [a, b])
+        return fold_arith(op, a, b) or ast.BinOp(op, a, b)
 
     add_expr = _arith_expr
     term = _arith_expr
     power = lambda self, a, b: self._arith_expr(a, '**', b)
 
     def like(self, string, pattern):
-        return ast.BinOp('like', [string, pattern])
+        return ast.BinOp('like', string, pattern)
+
+    @no_inline
+    def and_test(self, args):
+        return fold_logical('and', *args) or ast.And(args)
+
+    @no_inline
+    def or_test(self, args):
+        return fold_logical('or', *args) or ast.Or(args)
 
-    and_test = no_inline(ast.And)
-    or_test = no_inline(ast.Or)
+    def not_test(self, expr):
+        return fold_not(expr) or ast.Not(expr)
 
-    not_test = ast.Not
+    def neg(self, expr):
+        return fold_neg(expr) or ast.Neg(expr)
+
+    def if_stmt(self, cond, then, else_=None):
+        if settings.optimize and isinstance(cond, ast.Const) and cond.type == T.bool:
+            # Constant condition. Keep only the branch that would run
+            # (codeblock() splices it into the enclosing block)
+            return then if cond.value else (else_ or ast.CodeBlock([]))
+        return ast.If(cond, then, else_)
 
-    neg = ast.Neg
     var = ast.Name
     getattr = ast.Attr
     named_expr = ast.NamedField
@@ -288,7 +308,6 @@ class TreeToAst(Transformer):
     return_stmt = ast.Return
     import_stmt = ast.Import
     throw = ast.Throw
-    if_stmt = ast.If
     while_stmt = ast.While
     for_stmt = ast.For
     try_catch = ast.Try
@@ -300,7 +319,16 @@ class TreeToAst(Transformer):
     def table_def_from_expr(self, const, name, table_expr):
         return ast.TableDefFromExpr(name, table_expr, const == 'const')
 
-    codeblock = no_inline(ast.CodeBlock)
+    @no_inline
+    def codeblock(self, stmts):
+        # Splice in the blocks of constant 'if' statements (see if_stmt), so blocks never nest
+        if any(isinstance(s, ast.CodeBlock) for s in stmts):
+            stmts = [
+                s2
+                for s in stmts
+                for s2 in (s.statements if isinstance(s, ast.CodeBlock) else [s])
+            ]
+        return ast.CodeBlock(stmts)
 
     def ellipsis(self, from_struct, *exclude):
         return ast.Ellipsis(from_struct, list(exclude))
@@ -309,19 +337,24 @@ class TreeToAst(Transformer):
         raise Exception("Unknown rule:", data)
 
 
+_OPEN_PARENS = frozenset({'LPAR', 'LSQB', 'LBRACE'})
+_CLOSE_PARENS = frozenset({'RPAR', 'RSQB', 'RBRACE'})
+
+
 class Postlexer:
     def process(self, stream):
         paren_level = []
         for token in stream:
-            if not (paren_level and paren_level[-1] == 'LPAR' and token.type == '_NL'):
+            type_ = token.type
+            if not (paren_level and paren_level[-1] == 'LPAR' and type_ == '_NL'):
                 assert token.end_pos is not None
                 yield token
 
-            if token.type in ('LPAR', 'LSQB', 'LBRACE'):
-                paren_level.append(token.type)
-            elif token.type in ('RPAR', 'RSQB', 'RBRACE'):
+            if type_ in _OPEN_PARENS:
+                paren_level.append(type_)
+            elif type_ in _CLOSE_PARENS:
                 p = paren_level.pop()
-                assert p == 'L' + token.type[1:]
+                assert p == 'L' + type_[1:]
 
     # XXX Hack for ContextualLexer. Maybe there's a more elegant solution?
     @property
@@ -342,23 +375,26 @@ def _edit_terminals(t):
         t.pattern = PatternRE('%s(?!\w)' % t.pattern.value)
 
 
-parser = Lark.open(
-    'preql.lark',
-    rel_to=__file__,
-    parser='lalr',
-    postlex=Postlexer(),
-    start=['module', 'expr'],
-    maybe_placeholders=True,
-    propagate_positions=True,
-    cache=True,
-    edit_terminals=_edit_terminals,
-)
+@lru_cache(maxsize=None)
+def get_parser():
+    """Returns the Preql parser. Built on first use, since loading it takes a while"""
+    return Lark.open(
+        'preql.lark',
+        rel_to=__file__,
+        parser='lalr',
+        postlex=Postlexer(),
+        start=['module', 'expr'],
+        maybe_placeholders=True,
+        propagate_positions=True,
+        cache=True,
+        edit_terminals=_edit_terminals,
+    )
 
 
 def terminal_desc(name):
     if name == '_NL':
         return "<NEWLINE>"
-    p = parser.get_terminal(name).pattern
+    p = get_parser().get_terminal(name).pattern
     if p.type == 'str':
         return p.value
     return '<%s>' % name
@@ -370,7 +406,7 @@ def terminal_list_desc(term_list):
 
 def parse_stmts(s, source_file, wrap_syntax_error=True):
     try:
-        tree = parser.parse(s + "\n", start="module")
+        tree = get_parser().parse(s + "\n", start="module")
     except UnexpectedInput as e:
         if not wrap_syntax_error:
             raise
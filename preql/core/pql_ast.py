@@ -1,4 +1,5 @@
 from dataclasses import field
+from functools import lru_cache
 from typing import Any, Dict, List, Optional, Union
 
 from preql.utils import TextReference, dataclass
@@ -12,7 +13,7 @@ from .types_impl import pql_repr
 # * Use two tiers of Ast?
 
 
-@dataclass
+@dataclass(slots=True)
 class Ast(Object):
     text_ref: Optional[TextReference] = field(init=False, default=None)
 
@@ -22,19 +23,20 @@ class Ast(Object):
 
 
 class Expr(Ast):
+    __slots__ = ()
     _args = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class Marker(Expr):
     pass
 
 
 class Statement(Ast):
-    pass
+    __slots__ = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class Name(Expr):
     "Reference to an object (table, tabledef, column (in `where`), instance, etc.)"
     name: str
@@ -43,20 +45,20 @@ class Name(Expr):
         return f'Name({self.name})'
 
 
-@dataclass
+@dataclass(slots=True)
 class Parameter(Expr):
     "A typed object without a value"
     name: str
     type: types.Type
 
 
-@dataclass
+@dataclass(slots=True)
 class ResolveParameters(Expr):
     obj: Object
     values: Dict[str, Object]
 
 
-@dataclass
+@dataclass(slots=True)
 class ParameterizedSqlCode(Expr):
     type: Object
     string: Object
@@ -64,7 +66,7 @@ class ParameterizedSqlCode(Expr):
     # state: Any
 
 
-@dataclass
+@dataclass(slots=True)
 class Attr(Expr):
     "Reference to an attribute (usually a column)"
     expr: Optional[Object]  # Expr
@@ -73,7 +75,7 @@ class Attr(Expr):
     _args = ('expr',)
 
 
-@dataclass
+@dataclass(slots=True)
 class Const(Expr):
     type: types.Type
     value: Any
@@ -82,66 +84,81 @@ class Const(Expr):
         return pql_repr(self.type, self.value)
 
 
-@dataclass
+@dataclass(slots=True)
 class Ellipsis(Expr):
     from_struct: Optional[Union[Expr, Marker]]
     exclude: List[Union[str, Marker]]
 
 
 class BinOpExpr(Expr):
+    __slots__ = ()
     _args = ('args',)
 
 
+class BinaryOpExpr(BinOpExpr):
+    "Operator with exactly two operands"
+    __slots__ = ()
+    _args = ('left', 'right')
+
+    @property
+    def args(self):
+        return [self.left, self.right]
+
+
 class UnaryOpExpr(Expr):
+    __slots__ = ()
     _args = ('expr',)
 
 
-@dataclass
-class Compare(BinOpExpr):
+@dataclass(slots=True)
+class Compare(BinaryOpExpr):
     op: str
-    args: List[Object]
+    left: Object
+    right: Object
 
 
-@dataclass
-class BinOp(BinOpExpr):
+@dataclass(slots=True)
+class BinOp(BinaryOpExpr):
     op: str
-    args: List[Object]
+    left: Object
+    right: Object
 
 
-@dataclass
+@dataclass(slots=True)
 class Or(BinOpExpr):
     args: List[Object]
 
 
-@dataclass
+@dataclass(slots=True)
 class And(BinOpExpr):
     args: List[Object]
 
 
-@dataclass
+@dataclass(slots=True)
 class Not(UnaryOpExpr):
     expr: Object
 
 
-@dataclass
+@dataclass(slots=True)
 class Neg(UnaryOpExpr):
     expr: Object
 
 
-@dataclass
-class Contains(BinOpExpr):
+@dataclass(slots=True)
+class Contains(BinaryOpExpr):
     op: str
-    args: List[Object]
+    left: Object
+    right: Object
 
 
-@dataclass
+@dataclass(slots=True)
 class DescOrder(Expr):
     value: Object
 
     _args = ('value',)
 
 
-@dataclass
+@dataclass(slots=True)
 class Range(Expr):
     start: Optional[Object]
     stop: Optional[Object]
@@ -149,7 +166,7 @@ class Range(Expr):
     _args = 'start', 'stop'
 
 
-@dataclass
+@dataclass(slots=True)
 class NamedField(Expr):
     name: Optional[str]
     value: Object  # (Expr, types.PqlType)
@@ -159,21 +176,21 @@ class NamedField(Expr):
 
 
 class TableOperation(Expr):
-    pass
+    __slots__ = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class Selection(TableOperation):
     table: Object
     conds: List[Expr]
 
 
-@dataclass
+@dataclass(slots=True)
 class Projection(TableOperation):
     table: Object
     fields: List[NamedField]
     groupby: bool = False
-    agg_fields: List[NamedField] = []
+    agg_fields: List[NamedField] = field(default_factory=list)
 
     def __post_init__(self):
         if self.groupby:
@@ -182,25 +199,25 @@ class Projection(TableOperation):
             assert self.fields and not self.agg_fields
 
 
-@dataclass
+@dataclass(slots=True)
 class Order(TableOperation):
     table: Object
     fields: List[Expr]
 
 
-@dataclass
+@dataclass(slots=True)
 class Update(TableOperation):
     table: Object
     fields: List[NamedField]
 
 
-@dataclass
+@dataclass(slots=True)
 class Delete(TableOperation):
     table: Object
     conds: List[Expr]
 
 
-@dataclass
+@dataclass(slots=True)
 class Slice(Expr):
     obj: Object
     range: Range
@@ -208,41 +225,41 @@ class Slice(Expr):
     _args = ('obj',)
 
 
-@dataclass
+@dataclass(slots=True)
 class New(Expr):
     type: str
     args: list  # Func args
 
 
-@dataclass
+@dataclass(slots=True)
 class NewRows(Expr):
     type: str
     args: list  # Func args
 
 
-@dataclass
+@dataclass(slots=True)
 class FuncCall(Expr):
     func: Any  # objects.Function ?
     args: list  # Func args
 
 
-@dataclass
+@dataclass(slots=True)
 class One(Expr):
     expr: Object
     nullable: bool = False
 
 
-@dataclass
+@dataclass(slots=True)
 class Type(Ast):
     type_obj: Object
     nullable: bool = False
 
 
 class Definition:
-    pass
+    __slots__ = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class ColumnDef(Ast, Definition):
     name: str
     type: Type
@@ -250,76 +267,76 @@ class ColumnDef(Ast, Definition):
     default: Optional[Expr] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class FuncDef(Statement, Definition):
     userfunc: Object  # XXX Why not use UserFunction?
 
 
-@dataclass
+@dataclass(slots=True)
 class TableDef(Statement, Definition):
     name: Id
     columns: List[Union[ColumnDef, Ellipsis]]
     methods: list
 
 
-@dataclass
+@dataclass(slots=True)
 class TableDefFromExpr(Statement, Definition):
     name: Id
     expr: Expr
     const: bool
 
 
-@dataclass
+@dataclass(slots=True)
 class StructDef(Statement, Definition):
     name: str
     members: list
 
 
-@dataclass
+@dataclass(slots=True)
 class SetValue(Statement):
     name: (Name, Attr)
     value: Expr
 
 
-@dataclass
+@dataclass(slots=True)
 class InsertRows(Statement):
     name: (Name, Attr)
     value: Expr
 
 
-@dataclass
+@dataclass(slots=True)
 class Print(Statement):
     value: List[Object]
 
 
-@dataclass
+@dataclass(slots=True)
 class Assert(Statement):
     cond: Object
 
 
-@dataclass
+@dataclass(slots=True)
 class Return(Statement):
     value: Object
 
 
-@dataclass
+@dataclass(slots=True)
 class Throw(Statement):
     value: Object
 
 
-@dataclass
+@dataclass(slots=True)
 class Import(Statement):
     module_path: str
     as_name: Optional[str] = None
     use_core: bool = True
 
 
-@dataclass
+@dataclass(slots=True)
 class CodeBlock(Statement):
     statements: List[Ast]
 
 
-@dataclass
+@dataclass(slots=True)
 class Try(Statement):
     try_: CodeBlock
     catch_name: Optional[str]
@@ -327,21 +344,21 @@ class Try(Statement):
     catch_block: CodeBlock
 
 
-@dataclass
+@dataclass(slots=True)
 class If(Statement):
     cond: Object
     then: Statement
     else_: Optional[Statement] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class For(Statement):
     var: str
     iterable: Object
     do: CodeBlock
 
 
-@dataclass
+@dataclass(slots=True)
 class While(Statement):
     cond: Object
     do: Statement
@@ -350,28 +367,42 @@ class While(Statement):
 # Collections
 
 
-@dataclass
+@dataclass(slots=True)
 class List_(Expr):
     type: Object
     elems: list
 
 
-@dataclass
+@dataclass(slots=True)
 class Table_Columns(Expr):
     type: Object
     cols: Dict[str, list]
 
 
-@dataclass
+@dataclass(slots=True)
 class Dict_(Expr):
     elems: dict
 
 
-def pyvalue(value):
-    "Create an AST node from a Python primitive. For internal use."
-    t = types.from_python(type(value))
-    return Const(t, value)
+@lru_cache(maxsize=4096)
+def _pyvalue(pytype, value):
+    return Const(types.from_python(pytype), value)
 
 
-false = Const(T.bool, False)
-true = Const(T.bool, True)
+def pyvalue(value):
+    """Create an AST node from a Python primitive. For internal use.
+
+    Nodes are shared between equal values, so they must not be mutated (e.g. by set_text_ref)
+    """
+    pytype = type(value)
+    if isinstance(value, float):
+        return Const(T.float, value)  # Not cached, because -0.0 == 0.0
+    if pytype not in (bool, int, str):
+        # Not cached, because subclasses (like IntEnum) are equal to their base values
+        return Const(types.from_python(pytype), value)
+    # Key by type too, so that 1 and True get different nodes
+    return _pyvalue(pytype, value)
+
+
+false = pyvalue(False)
+true = pyvalue(True)
@@ -9,7 +9,6 @@ import rich.progress
 import runtype
 
 from preql.context import context
-from preql.docstring.autodoc import AutoDocError, autodoc
 from preql.utils import listgen, re_split, safezip
 
 from . import pql_ast as ast
@@ -195,7 +194,7 @@ def pql_fmt(s: T.string):
 
     a = string_parts[0]
     for b in string_parts[1:]:
-        a = ast.BinOp("+", [a, b])
+        a = ast.BinOp("+", a, b)
 
     return cast_to_instance(a)
 
@@ -727,7 +726,7 @@ def pql_type(obj: T.any):
 
 def pql_repr(obj: T.any):
     """Returns the representation text of the given object"""
-    if obj.type <= T.projected | T.aggregated:
+    if obj.type <= objects.phantom_types:
         raise Signal.make(
             T.CompileError, obj, "repr() cannot run in projected/aggregated mode"
         )
@@ -851,6 +850,9 @@ def pql_help(inst: T.any = objects.null):
     if table_type:
         inst = T.table
 
+    # Imported here, because building the docstring parser is slow, and rarely needed
+    from preql.docstring.autodoc import AutoDocError, autodoc
+
     try:
         doc = autodoc(inst).print_text()  # TODO maybe html
         if doc:
@@ -1081,7 +1083,7 @@ def _rest_table_endpoint(table):
         params = dict(request.query_params)
         if params:
             conds = [
-                ast.Compare('=', [ast.Name(k), objects.pyvalue_inst(v)])
+                ast.Compare('=', ast.Name(k), objects.pyvalue_inst(v))
                 for k, v in params.items()
             ]
             expr = ast.Selection(tbl, conds)
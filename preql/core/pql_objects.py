@@ -5,7 +5,7 @@ A collection of objects that may come to interaction with the user.
 from typing import Any, Callable, Dict, List, Optional
 
 from preql import settings
-from preql.utils import SafeDict, X, dataclass, listgen
+from preql.utils import SafeDict, X, dataclass
 
 from . import pql_ast as ast
 from . import pql_types, sql
@@ -16,7 +16,7 @@ from .types_impl import flatten_type, join_names, pql_repr
 
 
 # Functions
-@dataclass
+@dataclass(slots=True)
 class Param(ast.Ast):
     name: str
     type: Optional[Object] = None
@@ -25,7 +25,7 @@ class Param(ast.Ast):
 
 
 class ParamVariadic(Param):
-    pass
+    __slots__ = ()
 
 
 @dataclass
@@ -110,29 +110,22 @@ class Function(Object):
     def __repr__(self):
         return f'<preql:Function | {self.name}: {self.type}>'
 
-    @listgen
     def match_params_fast(self, args):
-        for i, p in enumerate(self.params):
-            if i < len(args):
-                v = args[i]
-            else:
-                v = p.default
-                if v is None:
-                    msg = f"Function '{self.name}' is missing a value for parameter '{p.name}'"
-                    raise Signal.make(T.TypeError, None, msg)
-
-            yield p, v
+        matched = list(zip(self.params, args))
+        for p in self.params[len(args) :]:
+            if p.default is None:
+                msg = f"Function '{self.name}' is missing a value for parameter '{p.name}'"
+                raise Signal.make(T.TypeError, None, msg)
+            matched.append((p, p.default))
 
         if self.param_collector:
-            yield self.param_collector, ast.Dict_({})
+            matched.append((self.param_collector, ast.Dict_({})))
+        return matched
 
     def _localize_keys(self, struct):
         raise NotImplementedError()
 
     def match_params(self, args):
-        # if not self.name.startswith('_') and self.name not in ('PY', 'SQL', 'get_db_type'):
-        #     breakpoint()
-
         # If no keyword arguments, matching is much simpler and faster
         if all(not isinstance(a, (ast.NamedField, ast.Ellipsis)) for a in args):
             return self.match_params_fast(args)
@@ -187,38 +180,37 @@ class Function(Object):
             names_set.add(name)
 
         collected = {}
-        if first_named is not None:
-            for named_arg in args[first_named:]:
-                arg_name = named_arg.name
-                if arg_name in values:
-                    if arg_name in names_set:
-                        raise Signal.make(
-                            T.SyntaxError,
-                            None,
-                            f"Function '{self.name}' recieved argument '{arg_name}' both as keyword and as positional.",
-                        )
-
-                    names_set.add(arg_name)
-                    values[arg_name] = named_arg.value
-                elif self.param_collector:
-                    assert arg_name not in collected
-                    collected[arg_name] = named_arg.value
-                else:
-                    # TODO meta
+        for named_arg in args[first_named:]:
+            arg_name = named_arg.name
+            if arg_name in values:
+                if arg_name in names_set:
                     raise Signal.make(
-                        T.TypeError,
+                        T.SyntaxError,
                         None,
-                        f"Function '{self.name}' has no parameter named '{arg_name}'",
+                        f"Function '{self.name}' recieved argument '{arg_name}' both as keyword and as positional.",
                     )
 
+                names_set.add(arg_name)
+                values[arg_name] = named_arg.value
+            elif self.param_collector:
+                assert arg_name not in collected
+                collected[arg_name] = named_arg.value
+            else:
+                # TODO meta
+                raise Signal.make(
+                    T.TypeError,
+                    None,
+                    f"Function '{self.name}' has no parameter named '{arg_name}'",
+                )
+
         for name, value in values.items():
             if value is None:
                 # TODO meta
                 msg = f"Error calling function '{self.name}': parameter '{name}' has no value"
                 raise Signal.make(T.TypeError, None, msg)
 
-        matched = [(p, values.pop(p.name)) for p in self.params]
-        assert not values, values
+        # values was built from self.params, so it's already in parameter order
+        matched = list(zip(self.params, values.values()))
         if self.param_collector:
             matched.append((self.param_collector, ast.Dict_(collected)))
         return matched
@@ -272,6 +264,8 @@ def post_instance_getattr(inst, f: T.function):
 
 
 class AbsInstance(Object):
+    __slots__ = ()
+
     def get_attr(self, name):
         v = self.type.get_attr(name)
         return post_instance_getattr(self, v)
@@ -303,7 +297,12 @@ class ExceptionInstance(AbsInstance):
     exc: Exception
 
 
-@dataclass
+_non_instance_types = T.union[T.struct, T.table, T.unknown]
+_value_types = T.union[T.primitive, T.nulltype, T.t_id]
+phantom_types = T.union[T.projected, T.aggregated]
+
+
+@dataclass(slots=True)
 class Instance(AbsInstance):
     code: sql.Sql
     type: Type
@@ -320,7 +319,7 @@ class Instance(AbsInstance):
         #     return f'<instance of {self.type.repr(state)}>'
 
     def __post_init__(self):
-        assert not self.type.issubtype(T.union[T.struct, T.table, T.unknown])
+        assert not self.type.issubtype(_non_instance_types)
 
     def flatten_code(self):
         assert not self.type.issubtype(T.struct)
@@ -337,7 +336,7 @@ def pyvalue_inst(value, type_=None, force_type=False):
     if force_type:
         assert type_
     elif type_:
-        assert type_ <= T.union[T.primitive, T.nulltype, T.t_id]
+        assert type_ <= _value_types
         assert r.type == type_, (r.type, type_)
     else:
         type_ = r.type
@@ -347,7 +346,7 @@ def pyvalue_inst(value, type_=None, force_type=False):
     return Instance.make(r, type_, [])
 
 
-@dataclass
+@dataclass(slots=True)
 class ValueInstance(Instance):
     local_value: object
 
@@ -360,10 +359,10 @@ class ValueInstance(Instance):
 
 
 class CollectionInstance(Instance):
-    pass
+    __slots__ = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class TableInstance(CollectionInstance):
     def __post_init__(self):
         assert self.type <= T.table, self.type  # and not self.type <= T.list, self.type
@@ -386,7 +385,8 @@ class TableInstance(CollectionInstance):
             v = self.type.elems[name]
             return SelectedColumnInstance(self, v, name)
         except KeyError:
-            return super().get_attr(name)
+            # Explicit base call, since slotted classes can't use super() without arguments
+            return AbsInstance.get_attr(self, name)
 
 
 def make_instance_from_name(t, cn):
@@ -405,7 +405,6 @@ def make_instance(code, t, insts):
     if t.issubtype(T.struct):
         raise Signal.make(T.TypeError, t, "Cannot instanciate structs directly")
 
-    assert not t.issubtype(T.struct), t
     if t <= T.table:
         return TableInstance.make(code, t, insts)
     elif t <= T.unknown:
@@ -415,6 +414,8 @@ def make_instance(code, t, insts):
 
 
 class AbsStructInstance(AbsInstance):
+    __slots__ = ()
+
     type: Type
     attrs: Dict[str, Object]
 
@@ -432,7 +433,7 @@ class AbsStructInstance(AbsInstance):
         raise Signal.make(T.TypeError, None, msg)
 
 
-@dataclass
+@dataclass(slots=True)
 class StructInstance(AbsStructInstance):
     type: Type
     attrs: Dict[str, Object]
@@ -499,6 +500,8 @@ class StructInstance(AbsStructInstance):
 
 
 class RowInstance(StructInstance):
+    __slots__ = ()
+
     def primary_key(self):
         try:
             return self.attrs['id']
@@ -533,7 +536,7 @@ class UnknownInstance(AbsInstance):
 unknown = UnknownInstance()
 
 
-@dataclass
+@dataclass(slots=True)
 class SelectedColumnInstance(AbsInstance):
     parent: CollectionInstance
     type: Type
@@ -567,7 +570,12 @@ class SelectedColumnInstance(AbsInstance):
 
 
 def merge_subqueries(instances):
-    return SafeDict().update(*[i.subqueries for i in instances])
+    # Always a new dict, because callers may add to it (e.g. add_as_subquery)
+    merged = SafeDict()
+    for inst in instances:
+        if inst.subqueries:  # Usually empty
+            merged.update(inst.subqueries)
+    return merged
 
 
 def ensure_phantom_type(inst, ptype):
@@ -587,7 +595,7 @@ def projected(inst):
 
 
 def remove_phantom_type(inst):
-    if inst.type <= T.projected | T.aggregated:
+    if inst.type <= phantom_types:
         return inst.replace(type=inst.type.elem)
     return inst
 
@@ -602,7 +610,7 @@ def inherit_vectorized_type(t, objs):
 
 def inherit_phantom_type(o, objs):
     for src in objs:
-        if src.type <= T.projected | T.aggregated:
+        if src.type <= phantom_types:
             return ensure_phantom_type(o, src.type)
     return o
 
@@ -610,7 +618,7 @@ def inherit_phantom_type(o, objs):
 null = ValueInstance.make(sql.null, T.nulltype, [], None)
 
 
-@dataclass
+@dataclass(slots=True)
 class EmptyListInstance(TableInstance):
     """Special case, because it is untyped"""
 
@@ -690,7 +698,7 @@ def from_python(value: type(None)):
 
 @dsp
 def from_python(value: str):
-    return ast.Const(T.string, value)
+    return ast.pyvalue(value)
 
 
 @dsp
@@ -700,12 +708,12 @@ def from_python(value: bytes):
 
 @dsp
 def from_python(value: bool):
-    return ast.Const(T.bool, value)
+    return ast.pyvalue(value)
 
 
 @dsp
 def from_python(value: int):
-    return ast.Const(T.int, value)
+    return ast.pyvalue(value)
 
 
 @dsp
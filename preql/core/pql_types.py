@@ -9,7 +9,7 @@ import arrow
 import runtype
 from runtype.typesystem import TypeSystem
 
-from preql.utils import dataclass
+from preql.utils import dataclass, memoize
 
 from .base import Object
 
@@ -49,6 +49,15 @@ class Id:
         return Id(*[p.lower() for p in self.parts])
 
 
+@memoize
+def _supertype_names(typename, supertypes):
+    "Returns the typenames of the given type and all of its supertypes (like supertype_chain)"
+    names = {typename}
+    for st in supertypes:
+        names |= _supertype_names(st.typename, st.supertypes)
+    return frozenset(names)
+
+
 def _repr_type_elem(t, depth):
     return _repr_type(t, depth - 1) if isinstance(t, Type) else repr(t)
 
@@ -155,7 +164,7 @@ class Type(Object):
                 return True
 
         # TODO zip should be aware of lengths
-        if t.typename in (s.typename for s in self.supertype_chain()):
+        if t.typename in _supertype_names(self.typename, self.supertypes):
             return all(
                 e1.issubtype(e2) for e1, e2 in zip(self.elem_types, t.elem_types)
             )
@@ -364,7 +373,14 @@ _python_type_to_sql_type = {
 
 def from_python(t):
     # TODO throw proper exception if this fails
-    return _python_type_to_sql_type[t]
+    try:
+        return _python_type_to_sql_type[t]
+    except KeyError:
+        # Subclasses of the primitives, like IntEnum
+        for base in t.__mro__[1:]:
+            if base in _python_type_to_sql_type:
+                return _python_type_to_sql_type[base]
+        raise
 
 
 def common_type(t1, t2):
@@ -1,3 +1,4 @@
+from dataclasses import field
 from typing import Dict, List, Optional
 
 from preql.utils import X, dataclass, listgen, safezip
@@ -750,9 +751,9 @@ class Select(TableOperation):
     type: Type
     table: Sql  # XXX Table won't work with RawSQL
     fields: List[Sql]
-    conds: List[Sql] = []
-    group_by: List[Sql] = []
-    order: List[Sql] = []
+    conds: List[Sql] = field(default_factory=list)
+    group_by: List[Sql] = field(default_factory=list)
+    order: List[Sql] = field(default_factory=list)
 
     # MySQL doesn't support arithmetic in offset/limit, and we don't need it anyway
     offset: Optional[int] = None
@@ -1165,19 +1166,27 @@ def compile_type_def(table_name, table) -> Sql:
     )
 
 
+_IDS_PER_QUERY = 500
+
+
+def _ids_conds(ids):
+    """Yields an 'id IN (...)' condition for each chunk of ids"""
+    for i in range(0, len(ids), _IDS_PER_QUERY):
+        id_list = ', '.join(repr(id_) for id_ in ids[i : i + _IDS_PER_QUERY])
+        yield Contains('IN', [Name(T.t_id, 'id'), Primitive(T.t_id, id_list)])
+
+
 def deletes_by_ids(table, ids):
-    for id_ in ids:
-        compare = Compare('=', [Name(T.t_id, 'id'), Primitive(T.t_id, repr(id_))])
-        yield Delete(TableName(table.type, table.type.options['name']), [compare])
+    for cond in _ids_conds(ids):
+        yield Delete(TableName(table.type, table.type.options['name']), [cond])
 
 
 def updates_by_ids(table, proj, ids):
     # TODO this function is not safe & secure enough
     sql_proj = {Name(value.type, name): value.code for name, value in proj.items()}
-    for id_ in ids:
-        compare = Compare('=', [Name(T.t_id, 'id'), Primitive(T.t_id, repr(id_))])
+    for cond in _ids_conds(ids):
         yield Update(
-            TableName(table.type, table.type.options['name']), sql_proj, [compare]
+            TableName(table.type, table.type.options['name']), sql_proj, [cond]
         )
 
 
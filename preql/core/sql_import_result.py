@@ -133,7 +133,6 @@ def sql_result_to_python(res: T.bool):
 def sql_result_to_python(res: T.int):
     item = _extract_primitive(res, 'int')
     if not isinstance(item, int):
-        breakpoint()
         raise Signal.make(
             T.ValueError, None, f"Expected SQL to return an int. Instead got '{item}'"
         )
@@ -214,32 +213,34 @@ def _bool_from_sql(n):
     return n
 
 
+_SQL_TYPES = {
+    'integer': T.int,
+    'int': T.int,  # mysql
+    'tinyint(1)': T.bool,  # mysql
+    'serial': T.t_id,
+    'bigserial': T.t_id,
+    'smallint': T.int,  # TODO smallint / bigint?
+    'bigint': T.int,
+    'character varying': T.string,
+    'character': T.string,  # TODO char?
+    'real': T.float,
+    'float': T.float,
+    'double precision': T.float,  # double on 32-bit?
+    'boolean': T.bool,
+    'timestamp': T.timestamp,
+    'timestamp without time zone': T.timestamp,
+    'timestamp with time zone': T.datetime,
+    'datetime': T.datetime,
+    'date': T.date,
+    'time': T.time,
+    'text': T.text,
+}
+
+
 def type_from_sql(type, nullable):
     type = type.lower()
-    d = {
-        'integer': T.int,
-        'int': T.int,  # mysql
-        'tinyint(1)': T.bool,  # mysql
-        'serial': T.t_id,
-        'bigserial': T.t_id,
-        'smallint': T.int,  # TODO smallint / bigint?
-        'bigint': T.int,
-        'character varying': T.string,
-        'character': T.string,  # TODO char?
-        'real': T.float,
-        'float': T.float,
-        'double precision': T.float,  # double on 32-bit?
-        'boolean': T.bool,
-        'timestamp': T.timestamp,
-        'timestamp without time zone': T.timestamp,
-        'timestamp with time zone': T.datetime,
-        'datetime': T.datetime,
-        'date': T.date,
-        'time': T.time,
-        'text': T.text,
-    }
     try:
-        v = d[type]
+        v = _SQL_TYPES[type]
     except KeyError:
         if type.startswith('int('):  # TODO actually parse it
             return T.int
@@ -1,3 +1,4 @@
+import sys
 from contextlib import contextmanager
 from copy import copy
 from logging import getLogger
@@ -13,6 +14,9 @@ class NameNotFound(Exception):
     pass
 
 
+_NOT_FOUND = object()
+
+
 logger = getLogger('state')
 
 
@@ -26,7 +30,11 @@ class Namespace:
             [self._ns[0]] + [dict(n) for n in self._ns[1:]]
         )  # Shared global namespace
 
-    def get_var(self, name):
+    def _lookup(self, name):
+        """Like get_var(), but returns _NOT_FOUND instead of raising
+
+        (Builtins are only found after a miss, so this keeps them cheap)
+        """
         # Uses context.parameters, set in Interpreter
         parameters = getattr(context, 'parameters', None)
         if parameters and name in parameters:
@@ -36,7 +44,13 @@ class Namespace:
             if name in scope:
                 return scope[name]
 
-        raise NameNotFound(name)
+        return _NOT_FOUND
+
+    def get_var(self, name):
+        value = self._lookup(name)
+        if value is _NOT_FOUND:
+            raise NameNotFound(name)
+        return value
 
     def set_var(self, name, value):
         if isinstance(name, Id):
@@ -51,21 +65,23 @@ class Namespace:
         assert not isinstance(value, ast.Name)
         self._ns[-1][name] = value
 
-    @contextmanager
-    def use_scope(self, scope: dict):
+    def push_scope(self, scope: dict):
+        """Push a new scope, and return a token for the matching pop_scope()"""
         x = len(self._ns)
         self._ns.append(scope)
+        return x
+
+    def pop_scope(self, token):
+        _discarded_scope = self._ns.pop()
+        assert token == len(self._ns)
+
+    @contextmanager
+    def use_scope(self, scope: dict):
+        token = self.push_scope(scope)
         try:
             yield
         finally:
-            _discarded_scope = self._ns.pop()
-            assert x == len(self._ns)
-
-    # def push_scope(self):
-    #     self.ns.append({})
-
-    # def pop_scope(self):
-    #     return self.ns.pop()
+            self.pop_scope(token)
 
     def __len__(self):
         return len(self._ns)
@@ -122,7 +138,8 @@ class State:
 
     def unique_name(self, obj):
         self.tick[0] += 1
-        return obj + str(self.tick[0])
+        # Interned, since these names are used as keys for subqueries and elems
+        return sys.intern(obj + str(self.tick[0]))
 
 
 class ThreadState:
@@ -183,25 +200,21 @@ class ThreadState:
         return self.ns.get_all_vars_with_rank()
 
     def has_var(self, name):
-        try:
-            self.ns.get_var(name)
-        except NameNotFound:
-            return False
-
-        return True
+        return self.ns._lookup(name) is not _NOT_FOUND
 
     def get_var(self, name):
+        value = self.ns._lookup(name)
+        if value is not _NOT_FOUND:
+            return value
+
+        builtins = self.ns.get_var('__builtins__')
+        assert builtins.type <= T.module
         try:
-            return self.ns.get_var(name)
-        except NameNotFound:
-            builtins = self.ns.get_var('__builtins__')
-            assert builtins.type <= T.module
-            try:
-                return builtins.namespace[name]
-            except KeyError:
-                pass
+            return builtins.namespace[name]
+        except KeyError:
+            pass
 
-            raise Signal.make(T.NameError, name, f"Name '{name}' is not defined")
+        raise Signal.make(T.NameError, name, f"Name '{name}' is not defined")
 
     def set_var(self, name, value):
         try:
@@ -212,6 +225,12 @@ class ThreadState:
     def use_scope(self, scope: dict):
         return self.ns.use_scope(scope)
 
+    def push_scope(self, scope: dict):
+        return self.ns.push_scope(scope)
+
+    def pop_scope(self, token):
+        return self.ns.pop_scope(token)
+
     def __copy__(self):
         return self.clone(self)
 
@@ -230,6 +249,14 @@ def use_scope(scope):
     return context.state.use_scope(scope)
 
 
+def push_scope(scope):
+    return context.state.push_scope(scope)
+
+
+def pop_scope(token):
+    return context.state.pop_scope(token)
+
+
 def get_var(name):
     return context.state.get_var(name)
 
@@ -1,3 +1,6 @@
+import io
+from copy import deepcopy
+from functools import lru_cache
 from typing import Optional
 
 from runtype import dataclass
@@ -6,7 +9,7 @@ from preql.core.pql_objects import Function, MethodInstance, Module, T
 from preql.core.pql_types import Type, subtypes
 from preql.docstring.docstring import Defin, Section, Text, parse
 from preql.settings import color_theme
-from preql.utils import dsp, safezip
+from preql.utils import dsp
 
 from . import type_docs
 
@@ -28,12 +31,19 @@ class ModuleDoc:
         s += f'[{color_kw}]{line}[/{color_kw}]\n\n\n'
         return s + '\n\n'.join(i.print_text(2) for i in self.items)
 
-    def print_rst(self):
-        s = f'\n{self.module.name}\n'
+    def print_rst(self, out=None):
+        "Returns the rst as a string, or writes it into the file 'out' one item at a time"
+        if out is None:
+            out = io.StringIO()
+            self.print_rst(out)
+            return out.getvalue()
+
         line = '-' * len(self.module.name)
-        s += f'{line}\n\n\n'
-        items = [i.print_rst() for i in self.items]
-        return s + '\n\n'.join(items)
+        out.write(f'\n{self.module.name}\n{line}\n\n\n')
+        for i, item in enumerate(self.items):
+            if i:
+                out.write('\n\n')
+            out.write(item.print_rst())
 
 
 @dataclass
@@ -103,11 +113,17 @@ class TypeDoc:
 from lark import LarkError
 
 
+@lru_cache(maxsize=1024)
+def _parse_docstring(docstring):
+    # Callers get the shared tree, and must copy it before changing it
+    return parse(docstring)
+
+
 def doc_func(f, parent_type=None):
     if isinstance(f, MethodInstance):
         f = f.func
     try:
-        doc_tree = parse(f.docstring or '')
+        doc_tree = deepcopy(_parse_docstring(f.docstring or ''))
     except LarkError as e:
         raise AutoDocError(f"Error in docstring of function {f.name}: {e}")
 
@@ -135,7 +151,7 @@ def doc_func(f, parent_type=None):
         if len(params) != len(params_doc.items):
             raise AutoDocError(f"Parameters don't match docstring in function {f}")
 
-        for d, p in safezip(params_doc.items, params):
+        for d, p in zip(params_doc.items, params):  # Lengths are checked above
             assert d.name == p.name, (d.name, p.name)
             d.type = str(p.type) if p.type else ''
             d.default = p.default.repr() if p.default else ''
@@ -144,7 +160,7 @@ def doc_func(f, parent_type=None):
 
 
 def doc_module(m):
-    return ModuleDoc(m, list(map(doc_func, m.public_functions())))
+    return ModuleDoc(m, [doc_func(f) for f in m.public_functions()])
 
 
 # def test_func():
@@ -173,9 +189,11 @@ def generate_rst(modules_fn, types_fn):
     with open(modules_fn, 'w', encoding='utf8') as f:
         print('Preql Modules', file=f)
         print('=============', file=f)
-        print(doc_module(p('__builtins__')).print_rst(), file=f)
+        doc_module(p('__builtins__')).print_rst(f)
+        print(file=f)
         p('import graph')
-        print(doc_module(p('graph')).print_rst(), file=f)
+        doc_module(p('graph')).print_rst(f)
+        print(file=f)
 
 
 @dsp
@@ -195,7 +213,7 @@ def autodoc(t: Type):
     except KeyError:
         raise NotImplementedError(t)
     try:
-        doc_tree = parse(docstr)
+        doc_tree = deepcopy(_parse_docstring(docstr))
     except LarkError as e:
         raise AutoDocError(f"Error in docstring of type {t}")
 
@@ -1,5 +1,7 @@
+import dataclasses
 import re
 import time
+import types
 from collections import deque
 from contextlib import contextmanager
 from functools import wraps
@@ -13,10 +15,125 @@ from rich.text import Text
 from . import settings
 
 mut_dataclass = runtype.dataclass(check_types=settings.typecheck, frozen=False)
-dataclass = runtype.dataclass(check_types=settings.typecheck)
+_dataclass = runtype.dataclass(check_types=settings.typecheck)
 dsp = runtype.Dispatch()
 
 
+def _dataclass_getstate(self):
+    return [getattr(self, f.name) for f in dataclasses.fields(self)]
+
+
+def _dataclass_setstate(self, state):
+    for f, value in zip(dataclasses.fields(self), state):
+        object.__setattr__(self, f.name, value)
+
+
+def _getattr_with_defaults(defaults):
+    # With slots, defaults of init=False fields can't be class attributes,
+    # and __init__ doesn't assign them. Instead, we fall back to them when the slot is empty.
+    # (__getattr__ is only called after the regular lookup fails, so it costs nothing otherwise)
+    def __getattr__(self, name):
+        try:
+            return defaults[name]
+        except KeyError:
+            raise AttributeError(
+                f"'{type(self).__name__}' object has no attribute '{name}'"
+            ) from None
+
+    return __getattr__
+
+
+def _add_slots(cls):
+    """Recreates the given dataclass with __slots__ for its fields
+
+    Same as dataclass(slots=True) in Python 3.10+.
+    For the slots to take effect, all the base classes must define __slots__ too.
+    """
+    inherited = {
+        name for base in cls.__mro__[1:] for name in getattr(base, '__slots__', ())
+    }
+    slots = tuple(f.name for f in dataclasses.fields(cls) if f.name not in inherited)
+
+    cls_dict = dict(cls.__dict__)
+    for name in slots:
+        cls_dict.pop(name, None)  # Remove defaults, which conflict with the slots
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+    cls_dict['__slots__'] = slots
+    no_init_defaults = {
+        f.name: f.default
+        for f in dataclasses.fields(cls)
+        if not f.init and f.default is not dataclasses.MISSING
+    }
+    if no_init_defaults:
+        cls_dict['__getattr__'] = _getattr_with_defaults(no_init_defaults)
+    if cls.__dataclass_params__.frozen:
+        # Frozen instances can't be restored by setattr (e.g. in copy or pickle)
+        cls_dict['__getstate__'] = _dataclass_getstate
+        cls_dict['__setstate__'] = _dataclass_setstate
+    new_cls = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+    # Methods that close over the class (super(), or the generated frozen __setattr__)
+    # still point to the old class. Cells are read-only before Python 3.7,
+    # so we rebuild those methods with new closures instead.
+    for name, value in cls_dict.items():
+        if isinstance(value, property):
+            funcs = [
+                _rebind_closure(f, cls, new_cls)
+                for f in (value.fget, value.fset, value.fdel)
+            ]
+            new_value = property(*funcs, value.__doc__)
+            changed = funcs != [value.fget, value.fset, value.fdel]
+        elif isinstance(value, (classmethod, staticmethod)):
+            new_value = type(value)(_rebind_closure(value.__func__, cls, new_cls))
+            changed = new_value.__func__ is not value.__func__
+        else:
+            new_value = _rebind_closure(value, cls, new_cls)
+            changed = new_value is not value
+        if changed:
+            setattr(new_cls, name, new_value)
+
+    return new_cls
+
+
+def _make_cell(value):
+    return (lambda: value).__closure__[0]
+
+
+def _rebind_closure(func, old, new):
+    "Returns a copy of func, with closure cells that refer to 'old' now referring to 'new'"
+    closure = getattr(func, '__closure__', None)
+    if not closure:
+        return func
+
+    def _rebind_cell(cell):
+        try:
+            return _make_cell(new) if cell.cell_contents is old else cell
+        except ValueError:
+            return cell  # Empty cell
+
+    new_closure = tuple(_rebind_cell(cell) for cell in closure)
+    if all(a is b for a, b in zip(closure, new_closure)):
+        return func
+
+    new_func = types.FunctionType(
+        func.__code__, func.__globals__, func.__name__, func.__defaults__, new_closure
+    )
+    new_func.__kwdefaults__ = func.__kwdefaults__
+    new_func.__qualname__ = func.__qualname__
+    new_func.__doc__ = func.__doc__
+    new_func.__dict__.update(func.__dict__)
+    return new_func
+
+
+def dataclass(cls=None, *, slots=False):
+    def wrap(cls):
+        cls = _dataclass(cls)
+        return _add_slots(cls) if slots else cls
+
+    return wrap if cls is None else wrap(cls)
+
+
 class SafeDict(dict):
     def __setitem__(self, key, value):
         if key in self:
@@ -185,6 +302,7 @@ def expand_tab(s):
     return s.replace('\t', '    ')
 
 
+@_add_slots  # There's one for every AST node
 @mut_dataclass
 class TextReference:
     text: str
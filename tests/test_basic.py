@@ -1,3 +1,4 @@
+import re
 from multiprocessing.pool import ThreadPool
 
 from preql.core.sql import mysql, bigquery, sqlite
@@ -5,6 +6,8 @@ from unittest import skip, SkipTest
 
 from parameterized import parameterized_class
 
+from preql.core import pql_ast as ast
+from preql.core.parser import parse_stmts
 from preql.core.pql_objects import UserFunction
 from preql.core.exceptions import Signal
 from preql.core.pql_types import T, Id
@@ -178,6 +181,127 @@ class BasicTests(PreqlTests):
         self._assertSignal(T.TypeError, preql, '"a" % "b"')
         self._assertSignal(T.TypeError, preql, '3 ~ 3')
 
+    def _eval_outcome(self, preql, code):
+        try:
+            res = preql(code)
+        except Exception as e:
+            return 'error', type(e)
+        return type(res), res
+
+    def test_constant_folding(self):
+        preql = self.Preql()
+        preql('func ident(x) = x')
+
+        def unfolded(code):
+            # Calls aren't folded, so the operators must run through the compiler
+            return re.sub(r'(\d+\.\d+|\d+|"[^"]*"|\btrue\b|\bfalse\b)', r'ident(\1)', code)
+
+        exprs = [
+            # int
+            '7 + 2', '7 - 9', '7 * 3', '7 / 2', '7 /~ 2', '7 % 3', '2 ** 10', '-7',
+            '7 == 7', '7 != 7', '7 < 2', '7 >= 7',
+            # float
+            '2.5 + 1.5', '2.5 * 2.0', '7.5 / 2.5', '-2.5', '1.5 < 2.5', '1.5 == 1.5',
+            # mixed int/float
+            '2.5 * 2', '1 + 0.5', '7 / 2.0', '2 ** 0.5', '3 == 3.0', '2 < 2.5',
+            # string
+            '"a" + "b"', '"a" == "a"', '"a" < "b"', '"a" != "b"',
+            # bool
+            'true and false', 'true or false', 'not true', 'not false', 'true == false',
+            # Not foldable, must behave the same
+            '1 / 0', '(-8) ** 0.5', '10 ** 400', '10.0 ** 400',
+            '1 and 0', '0 or 2', '"a" or "b"', '1 and "a"',
+        ]
+        for expr in exprs:
+            self.assertEqual(
+                self._eval_outcome(preql, expr), self._eval_outcome(preql, unfolded(expr)), expr
+            )
+
+    def test_constant_folding_ast(self):
+        self.Preql()
+
+        def parse_expr(code):
+            (stmt,) = parse_stmts(code, '<test>')
+            return stmt
+
+        def folded(code):
+            c = parse_expr(code)
+            assert isinstance(c, ast.Const), (code, c)
+            return c.type, c.value
+
+        if self.optimized:
+            assert folded('1 + 2') == (T.int, 3)
+            assert folded('1 / 2') == (T.float, 0.5)
+            assert folded('1 < 2.5') == (T.bool, True)
+            assert folded('true and not false') == (T.bool, True)
+            assert folded('-(2 * 3)') == (T.int, -6)
+        else:
+            assert isinstance(parse_expr('1 + 2'), ast.BinOp)
+            assert isinstance(parse_expr('1 < 2.5'), ast.Compare)
+            assert isinstance(parse_expr('true and false'), ast.And)
+            assert isinstance(parse_expr('not true'), ast.Not)
+            assert isinstance(parse_expr('-(2)'), ast.Neg)
+
+        # Never folded
+        assert isinstance(parse_expr('1 / 0'), ast.BinOp)
+        assert isinstance(parse_expr('(-8) ** 0.5'), ast.BinOp)
+        assert isinstance(parse_expr('10 ** 400'), ast.BinOp)
+        assert isinstance(parse_expr('1 and 0'), ast.And)
+        assert isinstance(parse_expr('"a" or "b"'), ast.Or)
+        assert isinstance(parse_expr('"a" + 1'), ast.BinOp)
+
+    def test_constant_if(self):
+        preql = self.Preql()
+        preql('''
+            func f_true() {
+                x = 1
+                if (true) {
+                    x = 2
+                }
+                return x
+            }
+            func f_false() {
+                x = 1
+                if (false) {
+                    x = 2
+                }
+                return x
+            }
+            func f_false_else() {
+                x = 1
+                if (false) {
+                    x = 2
+                } else {
+                    x = 3
+                }
+                return x
+            }
+            func f_return() {
+                if (true) {
+                    return "then"
+                }
+                return "after"
+            }
+        ''')
+        assert preql.f_true() == 2
+        assert preql.f_false() == 1
+        assert preql.f_false_else() == 3
+        assert preql.f_return() == "then"
+
+        def body(code):
+            (func_def,) = parse_stmts(code, '<test>')
+            return func_def.userfunc.expr.statements
+
+        stmts = body('func f() {\n if (true) {\n a = 1\n b = 2\n }\n c = 3\n }')
+        if self.optimized:
+            # The taken branch is spliced into the enclosing block
+            assert [type(s) for s in stmts] == [ast.SetValue] * 3
+            assert not body('func f() {\n if (false) {\n a = 1\n }\n }')
+            stmts = body('func f() {\n if (false) {\n a = 1\n } else {\n a = 2\n }\n }')
+            assert [type(s) for s in stmts] == [ast.SetValue]
+        else:
+            assert [type(s) for s in stmts] == [ast.If, ast.SetValue]
+
     def test_table_arith(self):
         preql = self.Preql()
 
@@ -612,6 +736,32 @@ class BasicTests(PreqlTests):
         ''')
         self.assertEqual( list(preql.test()), [{'_':x} for x in [0, 1, 1]])
 
+    @uses_tables('a')
+    def test_list_nullable_members(self):
+        preql = self.Preql()
+        preql('''
+            table a {b: int?, c: int}
+            new a(2, 3)
+            r = one a
+
+            func make_list(mixed) {
+                try {
+                    if (mixed) {
+                        x = [r.b, 1]
+                    } else {
+                        x = [r.b, r.b]
+                    }
+                    return "ok"
+                } catch (e: TypeError) {
+                    return "TypeError"
+                }
+            }
+        ''')
+        # int? and int are different member types
+        assert preql.make_list(True) == "TypeError"
+        assert preql.make_list(False) == "ok"
+        assert preql('[r.c, 1]') == [3, 1]
+
     def test_range(self):
         preql = self.Preql()
         preql('''
@@ -974,6 +1124,90 @@ class BasicTests(PreqlTests):
         # TODO
         # assert preql('a == A[x==1]')
 
+    @uses_tables('A')
+    def test_new_rows(self):
+        preql = self.Preql()
+        preql._run_code('''
+            table A {x: int, y: string}
+            new A(0, "zero")
+            ids = new[] A([1, 2, 3]{x: item, y: "n"})
+        ''', '<test>')
+
+        ids = list(preql('ids'))
+        assert len(ids) == 3
+        for id_, x in zip(ids, [1, 2, 3]):
+            assert preql(f'A[id=={id_}]{{x}}') == [{'x': x}]
+
+        # More than one batch (of 500)
+        preql._run_code('ids = new[] A([1..1002]{x: item, y: "m"})', '<test>')
+        ids = list(preql('ids'))
+        assert len(ids) == 1001
+        assert len(set(ids)) == 1001
+        assert preql('count(A)') == 1005
+        for i in (0, 499, 500, 999, 1000):
+            assert preql(f'A[id=={ids[i]}]{{x}}') == [{'x': i + 1}]
+
+    @uses_tables('B', 'C', 'D')
+    def test_new_rows_fallbacks(self):
+        preql = self.Preql()
+
+        # Explicit id
+        preql._run_code('''
+            table B {id: int, x: int}
+            ids = new[] B([{id: 10, x: 1}, {id: 20, x: 2}])
+        ''', '<test>')
+        assert list(preql('ids')) == [10, 20]
+        assert preql('B[id==20]{x}') == [{'x': 2}]
+
+        # DEFAULT VALUES
+        preql._run_code('''
+            table C {}
+            ids = new[] C([1, 2, 3]{x: item})
+        ''', '<test>')
+        ids = list(preql('ids'))
+        assert len(set(ids)) == 3
+        assert preql('count(C)') == 3
+
+        # A failing row keeps the rows before it, like separate inserts
+        preql('''
+            table D {x: int}
+            new[] D([1, 2, 3]{x: item})
+            D.add_index("x", true)
+
+            func add_rows() {
+                try {
+                    new[] D([4, 5, 1, 6]{x: item})
+                    return "ok"
+                } catch (e: DbQueryError) {
+                    return "error"
+                }
+            }
+        ''')
+        assert preql.add_rows() == "error"
+        assert [r['x'] for r in preql('D{x} order {x}')] == [1, 2, 3, 4, 5]
+
+    @uses_tables('A')
+    def test_new_rows_failed_batch(self):
+        preql = self.Preql()
+        preql('''
+            table A {x: int}
+            new A(600)
+            A.add_index("x", true)
+
+            func add_rows() {
+                try {
+                    new[] A([1..1002]{x: item})
+                    return "ok"
+                } catch (e: DbQueryError) {
+                    return "error"
+                }
+            }
+        ''')
+        # The first batch, and the rows of the second batch before the failing one, are kept
+        assert preql.add_rows() == "error"
+        assert preql('count(A)') == 600
+        assert preql('max(A{x})') == 600
+
     @uses_tables('A')
     def test_delete(self):
         preql = self.Preql()
@@ -1224,6 +1458,31 @@ class BasicTests(PreqlTests):
         """)
         assert {x['item'] for x in p.a} == {1,2,5}, p.a
 
+    @uses_tables('a', 'b', 'c')
+    def test_projection_types(self):
+        # Projections with the same fields must not share a type
+        p = self.Preql()
+        p("""
+            table a {x: int}
+            new a(1)
+            table b = a{x}
+            table c = a{x}
+            new c(2)
+        """)
+        assert [r['x'] for r in p.b] == [1]
+        assert sorted(r['x'] for r in p.c) == [1, 2]
+
+        state = p._interp.state
+        b_type = state.get_var('b').type
+        c_type = state.get_var('c').type
+        assert b_type.options['name'] != c_type.options['name']
+
+        # Constant fields have the same type objects
+        proj1 = p._run_code('a{y: 1}', '<test>')
+        proj2 = p._run_code('a{y: 1}', '<test>')
+        assert proj1.type == proj2.type
+        assert proj1.type is not proj2.type
+
 
     @uses_tables('A')
     def test_partial_table(self):
@@ -1559,6 +1818,128 @@ class TestFlow(PreqlTests):
         assert row.x in a{x}
         ''')
 
+    def test_setup_context(self):
+        from preql.context import context
+
+        p = self.Preql()
+        interp = p._interp
+
+        with interp.setup_context():
+            outer = context.state
+            with interp.setup_context():
+                # Nested calls share the state of the enclosing call
+                assert context.state is outer
+            assert context.state is outer
+
+        # Repeated calls on the same thread keep using the same state
+        with interp.setup_context():
+            assert context.state is outer
+
+        p('x = 1')
+        p('x = x + 1')
+        assert p.x == 2
+
+        # Other threads get their own copy
+        with ThreadPool(processes=1) as pool:
+            other = pool.apply(lambda: interp._local_copies.state)
+        assert other is not outer
+
+    def test_const_types(self):
+        # Equality ignores nullability and options, but each constant must keep its own type
+        p = self.Preql()
+        int_n = T.int.as_nullable()
+        int_opt = T.int.replace(options={'default': 1})
+        assert int_n == int_opt == T.int
+        types = [T.int, int_n, int_opt, T.int]
+        with p._interp.setup_context():
+            insts = [ast.Const(t, 1).compile_to_inst() for t in types]
+        assert all(i.type is t for i, t in zip(insts, types))
+
+    def test_pyvalue_subclass(self):
+        from enum import IntEnum
+
+        class Color(IntEnum):
+            RED = 1
+
+        assert ast.pyvalue(Color.RED).type == T.int
+        assert ast.pyvalue(Color.RED).value is Color.RED
+        assert type(ast.pyvalue(1).value) is int
+        assert ast.pyvalue(True).type == T.bool
+
+    def test_early_return(self):
+        p = self.Preql()
+        p('''
+        func f_if(x) {
+            if (x > 0) {
+                return "pos"
+            } else {
+                return "neg"
+            }
+            return "unreachable"
+        }
+        func f_no_else(x) {
+            if (x > 0) {
+                return 1
+            }
+        }
+        func f_while() {
+            i = 0
+            while (true) {
+                i = i + 1
+                if (i == 3) {
+                    return i
+                }
+            }
+            return -1
+        }
+        func f_for() {
+            for (i in [1, 2, 3, 4]) {
+                if (i == 2) {
+                    return i
+                }
+            }
+            return -1
+        }
+        func f_nested() {
+            for (i in [1, 2, 3]) {
+                for (j in [10, 20, 30]) {
+                    if (i * j == 20) {
+                        return i + j
+                    }
+                }
+                return -2   // Only reached if the inner loop swallowed the return
+            }
+            return -1
+        }
+        func f_try() {
+            try {
+                return "try"
+            } catch (e: ValueError) {
+                return "catch"
+            }
+            return "after"
+        }
+        func f_catch() {
+            try {
+                throw new ValueError("oops")
+                return "try"
+            } catch (e: ValueError) {
+                return "catch"
+            }
+            return "after"
+        }
+        ''')
+
+        assert p.f_if(1) == "pos"
+        assert p.f_if(-1) == "neg"
+        assert p.f_no_else(1) == 1
+        assert p.f_no_else(0) is None
+        assert p.f_while() == 3
+        assert p.f_for() == 2
+        assert p.f_nested() == 21
+        assert p.f_try() == "try"
+        assert p.f_catch() == "catch"
+
 class TestTypes(PreqlTests):
     def test_types(self):
         assert T.int == T.int